@@ -0,0 +1,64 @@
+"""Measures how long it takes to make the messages for many emails that all have the same large attachment, with and
+without the attachment cache.
+
+This doesn't use the network or send anything. It times making the raw messages that send() would pass to the Gmail
+API, like a report mailer that attaches the same spreadsheet to every message:
+
+    python benchmarks/attachment_cache.py
+    python benchmarks/attachment_cache.py --count 200 --attachment-size 2000000
+
+Messages bigger than ezgmail.RESUMABLE_UPLOAD_SIZE (like the default 10 MB attachment's) are written to a temporary
+file instead, which copies the cached attachment into the file.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("EZGMAIL_LAZY_INIT", "1")  # Don't log in when importing ezgmail.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import ezgmail  # noqa: E402
+
+
+def timeIt(label, count, filenames):
+    ezgmail.clearAttachmentCache()
+    startTime = time.perf_counter()
+    for i in range(count):
+        message = ezgmail._createSendMessage(
+            "user%d@example.com" % i, "Weekly report", "The report is attached.", filenames
+        )
+        if isinstance(message, ezgmail._MessageFile):
+            message.fileObj.close()  # Delete the temporary file.
+    seconds = time.perf_counter() - startTime
+    print("  %-24s %7.3f s   %8.1f messages per second" % (label, seconds, count / seconds))
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=50, help="number of messages")
+    parser.add_argument("--attachment-size", type=int, default=10 * 1024 * 1024, help="size of the file in bytes")
+    args = parser.parse_args()
+
+    ezgmail.EMAIL_ADDRESS = "al@inventwithpython.com"
+    with tempfile.TemporaryDirectory() as folder:
+        spreadsheetFilename = os.path.join(folder, "report.xlsx")
+        with open(spreadsheetFilename, "wb") as fo:
+            fo.write(os.urandom(args.attachment_size))
+        notesFilename = os.path.join(folder, "notes.txt")
+        with open(notesFilename, "w") as fo:
+            fo.write("Notes about this week's report.\n" * 100)
+        print("%d messages, %d byte attachment" % (args.count, args.attachment_size))
+
+        originalCacheSize = ezgmail.ATTACHMENT_CACHE_SIZE
+        ezgmail.ATTACHMENT_CACHE_SIZE = 0
+        uncachedSeconds = timeIt("without the cache:", args.count, [spreadsheetFilename, notesFilename])
+        ezgmail.ATTACHMENT_CACHE_SIZE = originalCacheSize
+        cachedSeconds = timeIt("with the cache:", args.count, [spreadsheetFilename, notesFilename])
+        print("  (%.1fx faster with the cache)" % (uncachedSeconds / cachedSeconds))
+
+
+if __name__ == "__main__":
+    main()
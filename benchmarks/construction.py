@@ -0,0 +1,116 @@
+"""Measures how long it takes to make GmailThread and GmailMessage objects from large multipart threads.
+
+This doesn't use the network. It makes fake users.threads.get() dictionaries of long threads whose messages have many
+parts (like a thread of replies that each attach a few files), then times filling in a GmailThread's messages the way
+search() does, and making GmailMessage objects with and without copying their dictionaries:
+
+    python benchmarks/construction.py
+    python benchmarks/construction.py --threads 50 --messages 100 --parts 20
+"""
+
+import argparse
+import base64
+import copy
+import os
+import sys
+import time
+
+os.environ.setdefault("EZGMAIL_LAZY_INIT", "1")  # Don't log in when importing ezgmail.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import ezgmail  # noqa: E402
+
+
+def makePart(partId, i):
+    if i == 0:
+        text = "This is the body of the message. " * 50
+        return {
+            "partId": partId,
+            "mimeType": "text/plain",
+            "filename": "",
+            "headers": [{"name": "Content-Type", "value": 'text/plain; charset="UTF-8"'}],
+            "body": {"size": len(text), "data": base64.urlsafe_b64encode(text.encode()).decode()},
+        }
+    return {
+        "partId": partId,
+        "mimeType": "image/png",
+        "filename": "image%d.png" % i,
+        "headers": [
+            {"name": "Content-Type", "value": 'image/png; name="image%d.png"' % i},
+            {"name": "Content-Disposition", "value": 'attachment; filename="image%d.png"' % i},
+            {"name": "Content-Transfer-Encoding", "value": "base64"},
+            {"name": "X-Attachment-Id", "value": "f_%08d" % i},
+        ],
+        "body": {"attachmentId": "ANGjdJ" + "x" * 400, "size": 50000},
+    }
+
+
+def makeThreadObj(threadNum, numMessages, numParts):
+    messages = []
+    for m in range(numMessages):
+        headers = [{"name": "X-Header-%d" % h, "value": "value %d" % h} for h in range(30)]
+        headers += [
+            {"name": "From", "value": "Al Sweigart <al@inventwithpython.com>"},
+            {"name": "To", "value": "someone@example.com"},
+            {"name": "Subject", "value": "Re: Thread number %d" % threadNum},
+        ]
+        messages.append(
+            {
+                "id": "%08x%08x" % (threadNum, m),
+                "threadId": "%016x" % threadNum,
+                "labelIds": ["INBOX"],
+                "snippet": "This is the body of the message.",
+                "historyId": str(1000 + m),
+                "internalDate": str(1700000000000 + m * 1000),
+                "payload": {
+                    "partId": "",
+                    "mimeType": "multipart/mixed",
+                    "filename": "",
+                    "headers": headers,
+                    "body": {"size": 0},
+                    "parts": [makePart(str(p), p) for p in range(numParts)],
+                },
+            }
+        )
+    return {"id": "%016x" % threadNum, "historyId": str(1000 + numMessages), "snippet": "", "messages": messages}
+
+
+def timeIt(label, function, threadObjs):
+    # Each run gets its own copies, so that no run benefits from the work of an earlier one.
+    threadObjs = copy.deepcopy(threadObjs)
+    startTime = time.perf_counter()
+    for threadObj in threadObjs:
+        function(threadObj)
+    seconds = time.perf_counter() - startTime
+    print("  %-56s %8.3f s" % (label, seconds))
+
+
+def hydrateThread(threadObj):
+    gmailThread = ezgmail.GmailThread({"id": threadObj["id"], "historyId": threadObj["historyId"], "snippet": ""})
+    gmailThread._setExtendedThreadObj(threadObj)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=20, help="number of threads")
+    parser.add_argument("--messages", type=int, default=50, help="number of messages per thread")
+    parser.add_argument("--parts", type=int, default=10, help="number of MIME parts per message")
+    args = parser.parse_args()
+
+    threadObjs = [makeThreadObj(t, args.messages, args.parts) for t in range(args.threads)]
+    print("%d threads of %d messages with %d parts each" % (args.threads, args.messages, args.parts))
+
+    timeIt("GmailThread messages (as search() does it)", hydrateThread, threadObjs)
+    timeIt(
+        "GmailMessage(messageObj) for each message",
+        lambda threadObj: [ezgmail.GmailMessage(msg) for msg in threadObj["messages"]],
+        threadObjs,
+    )
+    timeIt(
+        "GmailMessage(messageObj, _copy=False) for each message",
+        lambda threadObj: [ezgmail.GmailMessage(msg, _copy=False) for msg in threadObj["messages"]],
+        threadObjs,
+    )
+
+
+if __name__ == "__main__":
+    main()
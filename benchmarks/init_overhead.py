@@ -0,0 +1,63 @@
+"""Measures how long it takes to set up EZGmail's Gmail API service object, and how much time each API call spends
+before it's sent.
+
+This doesn't use the network. It times importing ezgmail (in a new Python process, like a serverless function's cold
+start), making the service object the way init() does, and making users.messages.get() request objects:
+
+    python benchmarks/init_overhead.py
+    python benchmarks/init_overhead.py --count 20000
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+os.environ.setdefault("EZGMAIL_LAZY_INIT", "1")  # Don't log in when importing ezgmail.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import ezgmail  # noqa: E402
+from google.oauth2.credentials import Credentials  # noqa: E402
+from googleapiclient.discovery import build  # noqa: E402
+
+
+def timeIt(label, function, count):
+    startTime = time.perf_counter()
+    for i in range(count):
+        function()
+    seconds = time.perf_counter() - startTime
+    print("  %-48s %9.3f ms each" % (label, seconds / count * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=2000, help="number of request objects to make")
+    parser.add_argument("--builds", type=int, default=50, help="number of service objects to make")
+    args = parser.parse_args()
+
+    code = "import time; startTime = time.perf_counter(); import ezgmail; print(time.perf_counter() - startTime)"
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, env=environment)
+    print("Startup:")
+    print("  %-48s %9.3f ms" % ("import ezgmail (new process)", float(output.stdout) * 1000))
+
+    credentials = Credentials(token="fake-token")  # Making a service object doesn't use the credentials yet.
+    timeIt('build("gmail", "v1") (before)', lambda: build("gmail", "v1", credentials=credentials), args.builds)
+    timeIt("_buildService() (what init() does now)", lambda: ezgmail._buildService(credentials), args.builds)
+
+    ezgmail.SERVICE_GMAIL = ezgmail._buildService(credentials)
+    print("Each API call:")
+    timeIt(
+        "SERVICE_GMAIL.users().messages().get() (before)",
+        lambda: ezgmail.SERVICE_GMAIL.users().messages().get(userId="me", id="17d6c3a6d5e1b2f0"),
+        args.count,
+    )
+    timeIt(
+        '_getResource("messages").get() (now)',
+        lambda: ezgmail._getResource("messages").get(userId="me", id="17d6c3a6d5e1b2f0"),
+        args.count,
+    )
+
+
+if __name__ == "__main__":
+    main()
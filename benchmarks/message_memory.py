@@ -0,0 +1,125 @@
+"""Measures how much memory GmailMessage objects take up, and how long they take to make.
+
+This doesn't use the network. It makes fake users.messages.get() dictionaries that look like a typical email with a
+plain text body, an HTML body, and one attachment, and then makes GmailMessage objects out of them:
+
+    python benchmarks/message_memory.py
+    python benchmarks/message_memory.py --count 20000 --body-size 4000
+"""
+
+import argparse
+import base64
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("EZGMAIL_LAZY_INIT", "1")  # Don't log in when importing ezgmail.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import ezgmail  # noqa: E402
+
+
+def makeMessageObj(i, bodySize):
+    bodyText = ("Line %d of the message body. " % i) * (bodySize // 30)
+    bodyText += "\r\nOn Sun, Jan 1, 2023 at 12:00 PM Al wrote:\r\n> The quoted reply."
+    return {
+        "id": "%016x" % i,
+        "threadId": "%016x" % (i // 3),
+        "labelIds": ["INBOX", "UNREAD", "CATEGORY_PERSONAL"],
+        "snippet": bodyText[:200],
+        "historyId": str(1000000 + i),
+        "internalDate": str(1700000000000 + i * 1000),
+        "sizeEstimate": bodySize * 3,
+        "payload": {
+            "partId": "",
+            "mimeType": "multipart/mixed",
+            "filename": "",
+            "headers": [
+                {"name": "From", "value": "Al Sweigart <al@inventwithpython.com>"},
+                {"name": "To", "value": "someone%d@example.com" % i},
+                {"name": "Subject", "value": "Message number %d" % i},
+                {"name": "Date", "value": "Sun, 1 Jan 2023 12:00:00 -0800"},
+                {"name": "Content-Type", "value": 'multipart/mixed; boundary="000000000000abcdef"'},
+            ],
+            "body": {"size": 0},
+            "parts": [
+                {
+                    "partId": "0",
+                    "mimeType": "multipart/alternative",
+                    "filename": "",
+                    "headers": [{"name": "Content-Type", "value": "multipart/alternative"}],
+                    "body": {"size": 0},
+                    "parts": [
+                        {
+                            "partId": "0.0",
+                            "mimeType": "text/plain",
+                            "filename": "",
+                            "headers": [{"name": "Content-Type", "value": 'text/plain; charset="UTF-8"'}],
+                            "body": {
+                                "size": len(bodyText),
+                                "data": base64.urlsafe_b64encode(bodyText.encode()).decode(),
+                            },
+                        },
+                        {
+                            "partId": "0.1",
+                            "mimeType": "text/html",
+                            "filename": "",
+                            "headers": [{"name": "Content-Type", "value": 'text/html; charset="UTF-8"'}],
+                            "body": {
+                                "size": len(bodyText) + 11,
+                                "data": base64.urlsafe_b64encode(("<div>%s</div>" % bodyText).encode()).decode(),
+                            },
+                        },
+                    ],
+                },
+                {
+                    "partId": "1",
+                    "mimeType": "application/pdf",
+                    "filename": "report%d.pdf" % i,
+                    "headers": [{"name": "Content-Type", "value": 'application/pdf; name="report.pdf"'}],
+                    "body": {"attachmentId": "ANGjdJ" + "x" * 400, "size": 123456},
+                },
+            ],
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=100000, help="number of GmailMessage objects to make")
+    parser.add_argument("--body-size", type=int, default=1000, help="approximate size of each body in characters")
+    args = parser.parse_args()
+
+    messageObjs = [makeMessageObj(i, args.body_size) for i in range(args.count)]
+
+    gc.collect()
+    tracemalloc.start()
+    startTime = time.perf_counter()
+    # _copy=False is how search() and the other EZGmail functions make their GmailMessage objects. (A copy would also be
+    # counted here, when this is only meant to measure what's added on top of the dictionaries.)
+    gmailMessages = [ezgmail.GmailMessage(messageObj, _copy=False) for messageObj in messageObjs]
+    constructSeconds = time.perf_counter() - startTime
+    constructedBytes = tracemalloc.get_traced_memory()[0]
+
+    startTime = time.perf_counter()
+    for gmailMessage in gmailMessages:
+        gmailMessage.body
+    decodeSeconds = time.perf_counter() - startTime
+    decodedBytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print("%d messages with ~%d character bodies" % (args.count, args.body_size))
+    print(
+        "  construct:        %7.2f s   %8.1f MB   %6d bytes per message"
+        % (constructSeconds, constructedBytes / 1e6, constructedBytes // args.count)
+    )
+    print(
+        "  + decode bodies:  %7.2f s   %8.1f MB   %6d bytes per message"
+        % (decodeSeconds, decodedBytes / 1e6, decodedBytes // args.count)
+    )
+    print("  (This is the memory the GmailMessage objects use on top of the API response dictionaries.)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Measures how many messages per second GmailMessage can parse when they have deeply nested MIME parts.
+
+This doesn't use the network. It makes fake users.messages.get() dictionaries shaped like real-world emails: an HTML
+newsletter (multipart/related with inline images inside multipart/alternative), a reply with attachments
+(multipart/mixed around multipart/alternative), and a forwarded message that itself has attachments (multipart/mixed
+inside multipart/mixed inside multipart/related). Then it times making GmailMessage objects out of them:
+
+    python benchmarks/parsing.py
+    python benchmarks/parsing.py --count 50000 --depth 6
+"""
+
+import argparse
+import base64
+import gc
+import os
+import sys
+import time
+
+os.environ.setdefault("EZGMAIL_LAZY_INIT", "1")  # Don't log in when importing ezgmail.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import ezgmail  # noqa: E402
+
+TEXT = base64.urlsafe_b64encode(("This is the body of the message. " * 30).encode()).decode()
+HTML = base64.urlsafe_b64encode(("<p>This is the body of the message.</p>" * 30).encode()).decode()
+
+
+def makeHeaders(count, contentType):
+    headers = [{"name": "X-Header-%d" % i, "value": "value %d" % i} for i in range(count)]
+    headers.append({"name": "Content-Type", "value": contentType})
+    return headers
+
+
+def makeLeaf(mimeType, filename=""):
+    if filename:
+        return {
+            "partId": "",
+            "mimeType": mimeType,
+            "filename": filename,
+            "headers": makeHeaders(3, '%s; name="%s"' % (mimeType, filename)),
+            "body": {"attachmentId": "ANGjdJ" + "x" * 400, "size": 50000},
+        }
+    return {
+        "partId": "",
+        "mimeType": mimeType,
+        "filename": "",
+        "headers": makeHeaders(1, "%s; charset=UTF-8" % mimeType),
+        "body": {"size": 1000, "data": HTML if mimeType == "text/html" else TEXT},
+    }
+
+
+def numberParts(part, partId=""):
+    """Sets the partIds of ``part`` and its subparts the way the Gmail API does: "", "0", "1", "1.0", "1.1", and so on."""
+    part["partId"] = partId
+    for i, subpart in enumerate(part.get("parts", ())):
+        numberParts(subpart, ("%s.%d" % (partId, i)) if partId else str(i))
+
+
+def makeMultipart(mimeType, parts):
+    return {
+        "partId": "",
+        "mimeType": mimeType,
+        "filename": "",
+        "headers": makeHeaders(1, '%s; boundary="000000000000abcdef"' % mimeType),
+        "body": {"size": 0},
+        "parts": parts,
+    }
+
+
+def makeAlternative():
+    return makeMultipart("multipart/alternative", [makeLeaf("text/plain"), makeLeaf("text/html")])
+
+
+def makeForward(depth):
+    """Returns a multipart/mixed part of a forwarded message with attachments, which forwards another message if
+    ``depth`` is more than 1."""
+    parts = [makeAlternative(), makeLeaf("application/pdf", "forwarded%d.pdf" % depth)]
+    if depth > 1:
+        parts.append(makeMultipart("multipart/related", [makeForward(depth - 1)]))
+    return makeMultipart("multipart/mixed", parts)
+
+
+def makeMessageObj(i, kind, depth):
+    if kind == 0:  # An HTML newsletter with inline images.
+        related = [makeAlternative()] + [makeLeaf("image/png", "image%d.png" % n) for n in range(5)]
+        payload = makeMultipart("multipart/related", related)
+    elif kind == 1:  # A reply with attachments.
+        mixed = [makeAlternative()] + [makeLeaf("application/pdf", "report%d.pdf" % n) for n in range(3)]
+        payload = makeMultipart("multipart/mixed", mixed)
+    else:  # A forwarded message, which forwards more messages, each with their own attachments.
+        payload = makeMultipart("multipart/mixed", [makeAlternative(), makeForward(depth)])
+    numberParts(payload)
+    payload["headers"] = makeHeaders(40, "multipart/mixed") + [
+        {"name": "From", "value": "Al Sweigart <al@inventwithpython.com>"},
+        {"name": "To", "value": "someone@example.com"},
+        {"name": "Subject", "value": "Message number %d" % i},
+    ]
+    return {
+        "id": "%016x" % i,
+        "threadId": "%016x" % i,
+        "labelIds": ["INBOX"],
+        "snippet": "This is the body of the message.",
+        "historyId": str(1000 + i),
+        "internalDate": str(1700000000000 + i * 1000),
+        "payload": payload,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=20000, help="number of messages to parse")
+    parser.add_argument("--depth", type=int, default=4, help="how many times the forwarded messages are forwarded")
+    args = parser.parse_args()
+
+    messageObjs = [makeMessageObj(i, i % 3, args.depth) for i in range(args.count)]
+
+    gc.collect()
+    gc.disable()  # Like the timeit module, keep the garbage collector from adding noise to the measurement.
+    startTime = time.perf_counter()
+    gmailMessages = [ezgmail.GmailMessage(messageObj, _copy=False) for messageObj in messageObjs]
+    seconds = time.perf_counter() - startTime
+    gc.enable()
+    totalAttachments = sum(len(gmailMessage.attachments) for gmailMessage in gmailMessages)
+
+    print("%d messages (forwards nested %d deep), %d attachments found" % (args.count, args.depth, totalAttachments))
+    print("  parse: %7.3f s   %10.0f messages per second" % (seconds, args.count / seconds))
+
+
+if __name__ == "__main__":
+    main()
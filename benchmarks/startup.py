@@ -0,0 +1,64 @@
+"""Measures how long it takes to import ezgmail and how long until the first Gmail API call returns.
+
+Each measurement runs in a fresh Python process, since that's what a short-lived cron worker pays for. Run this from
+the folder that has your credentials and token.json files:
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 10 --skip-first-call
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+IMPORT_CODE = """
+import time
+start = time.perf_counter()
+import ezgmail
+print(time.perf_counter() - start)
+"""
+
+FIRST_CALL_CODE = """
+import time
+start = time.perf_counter()
+import ezgmail
+imported = time.perf_counter()
+ezgmail.recent(maxResults=1)
+print(imported - start, time.perf_counter() - imported)
+"""
+
+
+def runInFreshProcess(code, lazy):
+    env = dict(os.environ)
+    env["EZGMAIL_LAZY_INIT"] = "1" if lazy else "0"
+    output = subprocess.run([sys.executable, "-c", code], env=env, check=True, capture_output=True, text=True).stdout
+    return [float(value) for value in output.split()]
+
+
+def report(label, times):
+    print(
+        "%-40s median %8.1f ms   min %8.1f ms   max %8.1f ms"
+        % (label, statistics.median(times) * 1000, min(times) * 1000, max(times) * 1000)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="number of fresh processes per measurement")
+    parser.add_argument("--skip-first-call", action="store_true", help="only measure import time (no network)")
+    args = parser.parse_args()
+
+    for lazy in (False, True):
+        mode = "lazy" if lazy else "eager"
+        importTimes = [runInFreshProcess(IMPORT_CODE, lazy)[0] for i in range(args.runs)]
+        report("import ezgmail (%s)" % mode, importTimes)
+
+        if not args.skip_first_call:
+            results = [runInFreshProcess(FIRST_CALL_CODE, lazy) for i in range(args.runs)]
+            report("import + first recent() call (%s)" % mode, [a + b for a, b in results])
+
+
+if __name__ == "__main__":
+    main()
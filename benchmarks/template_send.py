@@ -0,0 +1,61 @@
+"""Measures how long it takes to make the messages for a newsletter with a large attachment, using send() versus a
+MessageTemplate.
+
+This doesn't use the network or send anything. It times making the raw messages that send() and
+MessageTemplate.send() would pass to the Gmail API, for many recipients:
+
+    python benchmarks/template_send.py
+    python benchmarks/template_send.py --count 500 --attachment-size 5000000
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("EZGMAIL_LAZY_INIT", "1")  # Don't log in when importing ezgmail.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import ezgmail  # noqa: E402
+
+SUBJECT = "The $month newsletter"
+BODY = "Hello $name,\n\nThis month's newsletter is attached.\n\nAl"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=50, help="number of recipients")
+    parser.add_argument("--attachment-size", type=int, default=2 * 1024 * 1024, help="size of the PDF in bytes")
+    args = parser.parse_args()
+
+    ezgmail.EMAIL_ADDRESS = "al@inventwithpython.com"
+    with tempfile.TemporaryDirectory() as folder:
+        pdfFilename = os.path.join(folder, "newsletter.pdf")
+        with open(pdfFilename, "wb") as fo:
+            fo.write(os.urandom(args.attachment_size))
+        recipients = [("user%d@example.com" % i, "User %d" % i) for i in range(args.count)]
+        print("%d recipients, %d byte attachment" % (args.count, args.attachment_size))
+
+        ezgmail.clearAttachmentCache()
+        startTime = time.perf_counter()
+        for address, name in recipients:
+            subject = SUBJECT.replace("$month", "May")
+            body = BODY.replace("$name", name)
+            ezgmail._createSendMessage(address, subject, body, [pdfFilename])
+        sendSeconds = time.perf_counter() - startTime
+        print("  send():           %7.3f s   %8.1f messages per second" % (sendSeconds, args.count / sendSeconds))
+
+        ezgmail.clearAttachmentCache()  # So that making the template has to read the attachment too.
+        startTime = time.perf_counter()
+        template = ezgmail.MessageTemplate(SUBJECT, BODY, [pdfFilename])
+        for address, name in recipients:
+            template.render(address, name=name, month="May")
+        templateSeconds = time.perf_counter() - startTime
+        print(
+            "  MessageTemplate:  %7.3f s   %8.1f messages per second   (%.1fx faster, including making the template)"
+            % (templateSeconds, args.count / templateSeconds, sendSeconds / templateSeconds)
+        )
+
+
+if __name__ == "__main__":
+    main()
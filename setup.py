@@ -26,6 +26,7 @@ setup(
     package_dir={'': 'src'},
     test_suite='tests',
     install_requires=['google-api-python-client', 'google-auth-httplib2', 'google-auth-oauthlib'],
+    extras_require={'aio': ['aiohttp']},
     keywords='',
     classifiers=[
         'License :: OSI Approved :: GNU General Public License v3 or later (GPLv3+)',
@@ -0,0 +1,401 @@
+"""Async versions of the EZGmail functions, for programs that use asyncio.
+
+These work like the functions in the ``ezgmail`` module, except that they are coroutines, so many Gmail API calls
+can be waiting on the network at the same time without using a thread for each one. They return the same
+``GmailThread`` and ``GmailMessage`` objects. This module needs the aiohttp package (``pip install aiohttp``).
+
+    >>> import asyncio
+    >>> import ezgmail.aio
+    >>> async def main():
+    ...     threads = await ezgmail.aio.search('from:al@inventwithpython.com')
+    ...     await ezgmail.aio.markAsRead(threads)
+    ...     await ezgmail.aio.close()
+    >>> asyncio.run(main())
+
+All of the HTTP requests share one aiohttp session, so connections to the Gmail API are reused, and at most
+``MAX_CONNECTIONS`` requests are sent at once. (The rest wait their turn.) Call ``close()`` when your program is done
+with this module. Like any coroutine, these can be cancelled (for example, with ``asyncio.wait_for()``), and when one
+API call fails, the calls running alongside it are cancelled.
+
+Accessing a ``GmailThread`` object's ``messages`` attribute (or the ``body`` of a message from a ``metadataOnly``
+search) still downloads them without ``await``, so use ``fetchMessages()`` and ``fetchFullMessages()`` first.
+"""
+
+import asyncio
+import base64
+import functools
+import os
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+import ezgmail
+from ezgmail import EZGmailException, GmailMessage, GmailThread
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None  # EZGmailException is raised when a function in this module is called.
+
+MAX_CONNECTIONS = 10  # How many HTTP requests the shared aiohttp session sends at the same time.
+
+_SESSION = None  # The shared aiohttp.ClientSession, made the first time it's needed.
+_SESSION_LOOP = None  # The event loop that _SESSION was made in.
+
+
+async def connect(userId="me", tokenFile="token.json", credentialsFile="."):
+    """Logs in to the Gmail account like ``ezgmail.connect()``, without blocking the event loop. The other functions
+    in this module call this automatically if you haven't logged in yet."""
+    if not ezgmail.LOGGED_IN:
+        await _runInThread(ezgmail.connect, userId, tokenFile, credentialsFile)
+
+
+async def close():
+    """Closes the shared aiohttp session. It's made again if another function in this module is called afterwards."""
+    global _SESSION, _SESSION_LOOP
+    if _SESSION is not None:
+        await _SESSION.close()
+        _SESSION = _SESSION_LOOP = None
+
+
+async def _getSession():
+    """Returns the shared aiohttp session for the running event loop, making it if needed."""
+    global _SESSION, _SESSION_LOOP
+    if aiohttp is None:
+        raise EZGmailException("ezgmail.aio needs the aiohttp package. Install it by running: pip install aiohttp")
+
+    loop = asyncio.get_running_loop()
+    session = _SESSION
+    if session is None or session.closed or _SESSION_LOOP is not loop:
+        # A session can only be used in the event loop it was made in (each asyncio.run() call has a new loop.) The
+        # new session replaces the old one before anything is awaited, so other coroutines don't make one too.
+        oldSession, oldLoop = _SESSION, _SESSION_LOOP
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=MAX_CONNECTIONS))
+        _SESSION, _SESSION_LOOP = session, loop
+        if oldSession is not None and not oldSession.closed:
+            await _closeOldSession(oldSession, oldLoop)
+    return session
+
+
+async def _closeOldSession(session, sessionLoop):
+    """Closes ``session``, which was made in the event loop ``sessionLoop`` instead of the running one. This happens
+    when a program didn't call ``close()`` before its event loop finished, or uses more than one event loop."""
+    if sessionLoop.is_running():
+        # The old loop is running in another thread, so the session has to be closed there.
+        await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(session.close(), sessionLoop))
+    else:
+        # If the old loop is closed, this can't close the sockets of the session's connections, but it releases them
+        # so that they're closed when they're garbage collected.
+        await session.close()
+
+
+async def _runInThread(function, *args):
+    """Calls the blocking ``function`` in the event loop's default thread pool, and returns its return value."""
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(function, *args))
+
+
+async def _execute(request):
+    """The async version of ``ezgmail._execute()``. Sends the googleapiclient ``request`` (made from
+    ``ezgmail.SERVICE_GMAIL``, which doesn't send anything until it is executed) with the shared aiohttp session, and
+    returns the response dictionary. An unsuccessful response raises the same ``HttpError`` that ``request.execute()``
+    would. Like ``ezgmail._execute()``, this waits to stay under ``ezgmail.QUOTA_UNITS_PER_SECOND`` (which is shared
+    with the non-async functions) and retries rate limit and temporary server errors (except for the calls in
+    ``ezgmail.NON_IDEMPOTENT_METHODS``)."""
+    session = await _getSession()
+    cost = ezgmail._getQuotaCost(request)
+    retryServerErrors = getattr(request, "methodId", None) not in ezgmail.NON_IDEMPOTENT_METHODS
+    attempt = 0
+    while True:
+        await asyncio.sleep(ezgmail._QUOTA.reserve(cost))
+        headers = {name: value for name, value in request.headers.items() if name.lower() != "content-length"}
+        credentials = ezgmail._CREDENTIALS
+        if credentials is not None:
+            if not credentials.valid:
+                await _runInThread(ezgmail._refreshCredentials, credentials)
+            credentials.apply(headers)
+
+        async with session.request(request.method, request.uri, data=request.body, headers=headers) as response:
+            content = await response.read()
+            responseInfo = dict(response.headers)
+            responseInfo["status"] = response.status
+
+        try:
+            # The request's postproc() is what parses the JSON (and raises HttpError) for request.execute().
+            return request.postproc(httplib2.Response(responseInfo), content)
+        except HttpError as exc:
+            retryDelay = ezgmail._getRetryDelay(exc, attempt, retryServerErrors)
+            if retryDelay is None:
+                raise
+        ezgmail._QUOTA.recordRetry()
+        await asyncio.sleep(retryDelay)
+        attempt += 1
+
+
+async def _gather(coroutines):
+    """Runs the ``coroutines`` at the same time and returns a list of their return values. If any of them raises an
+    exception (or this is cancelled), the others are cancelled and the exception is raised here."""
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+async def search(query, maxResults=25, userId="me", prefetch=True, metadataOnly=False):
+    """The async version of ``ezgmail.search()``. Returns a list of ``GmailThread`` objects that match the search
+    ``query``. If ``prefetch`` is ``True``, the messages of all the threads are downloaded at the same time before
+    this returns."""
+    await connect()
+
+    gmailThreads = []
+    pageToken = None
+    while len(gmailThreads) < maxResults:
+        maxPageResults = min(maxResults - len(gmailThreads), ezgmail.MAX_PAGE_SIZE)
+        response = await _execute(
+            ezgmail._getResource("threads").list(userId=userId, q=query, maxResults=maxPageResults, pageToken=pageToken)
+        )
+        gmailThreads.extend(GmailThread(threadObj, _copy=False) for threadObj in response.get("threads", []))
+        pageToken = response.get("nextPageToken")
+        if pageToken is None:
+            break
+    gmailThreads = gmailThreads[:maxResults]
+
+    if prefetch:
+        await fetchMessages(gmailThreads, userId, metadataOnly)
+    return gmailThreads
+
+
+async def recent(maxResults=25, userId="me", prefetch=True, metadataOnly=False):
+    """The async version of ``ezgmail.recent()``."""
+    return await search("label:INBOX", maxResults, userId, prefetch, metadataOnly)
+
+
+async def unread(maxResults=25, userId="me", prefetch=True, metadataOnly=False):
+    """The async version of ``ezgmail.unread()``."""
+    return await search("label:UNREAD", maxResults, userId, prefetch, metadataOnly)
+
+
+async def fetchMessages(gmailThreads, userId="me", metadataOnly=False):
+    """Downloads the messages of every ``GmailThread`` object in ``gmailThreads`` (a single thread or a list of them)
+    that hasn't downloaded them yet, all at the same time. Afterwards, their ``messages`` attributes can be used
+    without blocking. If ``metadataOnly`` is ``True``, only the headers, snippets, timestamps, and labels of the
+    messages are downloaded."""
+    await connect()
+    if isinstance(gmailThreads, GmailThread):
+        gmailThreads = [gmailThreads]  # Make this uniformly in a list.
+
+    async def fetch(gmailThread):
+        extendedThreadObj = ezgmail._getCachedThreadObj(gmailThread.id, gmailThread.historyId)
+        if extendedThreadObj is None:
+            extendedThreadObj = await _execute(ezgmail._getThreadRequest(gmailThread.id, userId, metadataOnly))
+            if not metadataOnly:
+                ezgmail._cacheThreadObj(extendedThreadObj)  # Only full messages go in the cache.
+            gmailThread._setExtendedThreadObj(extendedThreadObj, metadataOnly)
+        else:
+            gmailThread._setExtendedThreadObj(extendedThreadObj)
+
+    await _gather(fetch(gmailThread) for gmailThread in gmailThreads if gmailThread._messages is None)
+
+
+async def fetchFullMessages(gmailMessages, userId="me"):
+    """Downloads the bodies and attachment info of every ``GmailMessage`` object in ``gmailMessages`` (a single message
+    or a list of them) that came from a ``metadataOnly`` search, all at the same time. Afterwards, their ``body`` and
+    ``attachments`` attributes can be used without blocking."""
+    await connect()
+    if isinstance(gmailMessages, GmailMessage):
+        gmailMessages = [gmailMessages]  # Make this uniformly in a list.
+
+    async def fetch(gmailMessage):
+        gmailMessage._setFullMessageObj(
+            await _execute(ezgmail._getResource("messages").get(userId=userId, id=gmailMessage.id))
+        )
+
+    await _gather(fetch(gmailMessage) for gmailMessage in gmailMessages if gmailMessage._metadataOnly)
+
+
+async def send(
+    recipient,
+    subject,
+    body,
+    attachments=None,
+    sender=None,
+    cc=None,
+    bcc=None,
+    mimeSubtype="plain",
+    progressCallback=None,
+    _threadId=None,
+):
+    """The async version of ``ezgmail.send()``. The attachment files are read in a separate thread so that they don't
+    block the event loop.
+
+    Like ``ezgmail.send()``, emails bigger than ``ezgmail.RESUMABLE_UPLOAD_SIZE`` bytes are sent with a resumable
+    upload. The upload runs in a separate thread, so ``progressCallback`` is called from that thread, not from the
+    event loop."""
+    await connect()
+    args = (recipient, subject, body, attachments, sender, cc, bcc, mimeSubtype, _threadId)
+    if attachments is None:
+        message = ezgmail._createSendMessage(*args)
+    else:
+        message = await _runInThread(ezgmail._createSendMessage, *args)
+
+    if isinstance(message, ezgmail._MessageFile) or ezgmail._getRawMessageSize(message) > ezgmail.RESUMABLE_UPLOAD_SIZE:
+        # Large messages are uploaded a chunk at a time by ezgmail, in a separate thread.
+        await _runInThread(ezgmail._sendMessage, message, "me", progressCallback)
+        return
+
+    await _execute(ezgmail._getResource("messages").send(userId="me", body=message))
+    if progressCallback is not None:
+        messageSize = ezgmail._getRawMessageSize(message)
+        progressCallback(messageSize, messageSize)
+
+
+async def modifyLabels(gmailObjects, addLabels=None, removeLabels=None, userId="me"):
+    """The async version of ``ezgmail.modifyLabels()``. Adds the labels in ``addLabels`` to and removes the labels in
+    ``removeLabels`` from every message in the GmailThread or GmailMessage objects in ``gmailObjects``, with
+    users.messages.batchModify() calls of up to ``ezgmail.MAX_BATCH_MODIFY_IDS`` messages each."""
+    await connect()
+    if isinstance(gmailObjects, (GmailThread, GmailMessage)):
+        gmailObjects = [gmailObjects]  # Make this uniformly in a list.
+    if isinstance(addLabels, str):
+        addLabels = [addLabels]
+    if isinstance(removeLabels, str):
+        removeLabels = [removeLabels]
+    labelChanges = {"addLabelIds": list(addLabels or []), "removeLabelIds": list(removeLabels or [])}
+    if not labelChanges["addLabelIds"] and not labelChanges["removeLabelIds"]:
+        return
+
+    gmailObjects = list(gmailObjects)
+    ezgmail._checkGmailObjects(gmailObjects, "modifyLabels")
+
+    async def getMessageIds(obj):
+        if isinstance(obj, GmailMessage):
+            return [obj.id]
+        if obj._messages is not None:
+            return [msg.id for msg in obj._messages]
+        response = await _execute(
+            ezgmail._getResource("threads").get(userId=userId, id=obj.id, format="minimal", fields="id,messages/id")
+        )
+        return [msg["id"] for msg in response["messages"]]
+
+    messageIds = []
+    for ids in await _gather(getMessageIds(obj) for obj in gmailObjects):
+        messageIds.extend(ids)
+    messageIds = list(dict.fromkeys(messageIds))  # Remove duplicate ids, but keep them in order.
+
+    async def batchModify(ids):
+        await _execute(
+            ezgmail._getResource("messages").batchModify(userId=userId, body=dict(labelChanges, ids=ids))
+        )
+
+    chunkSize = ezgmail.MAX_BATCH_MODIFY_IDS
+    await _gather(batchModify(messageIds[i : i + chunkSize]) for i in range(0, len(messageIds), chunkSize))
+
+
+async def addLabel(gmailObjects, label, userId="me"):
+    """Adds the label ``label`` to every message in the GmailThread or GmailMessage objects in ``gmailObjects``."""
+    await modifyLabels(gmailObjects, addLabels=[label], userId=userId)
+
+
+async def removeLabel(gmailObjects, label, userId="me"):
+    """Removes the label ``label`` from every message in the GmailThread or GmailMessage objects in
+    ``gmailObjects``."""
+    await modifyLabels(gmailObjects, removeLabels=[label], userId=userId)
+
+
+async def markAsRead(gmailObjects, userId="me"):
+    """Marks every message in the GmailThread or GmailMessage objects in ``gmailObjects`` as read."""
+    await modifyLabels(gmailObjects, removeLabels=["UNREAD"], userId=userId)
+
+
+async def markAsUnread(gmailObjects, userId="me"):
+    """Marks every message in the GmailThread or GmailMessage objects in ``gmailObjects`` as unread."""
+    await modifyLabels(gmailObjects, addLabels=["UNREAD"], userId=userId)
+
+
+async def trash(gmailObjects, userId="me"):
+    """The async version of ``ezgmail.trash()``, except that this raises the exception of the first thread or message
+    that couldn't be trashed instead of returning a list of failures."""
+    await connect()
+    if isinstance(gmailObjects, (GmailThread, GmailMessage)):
+        gmailObjects = [gmailObjects]  # Make this uniformly in a list.
+    gmailObjects = list(gmailObjects)
+    ezgmail._checkGmailObjects(gmailObjects, "trash")
+
+    async def trashOne(obj):
+        if isinstance(obj, GmailThread):
+            await _execute(ezgmail._getResource("threads").trash(userId=userId, id=obj.id))
+        else:
+            await _execute(ezgmail._getResource("messages").trash(userId=userId, id=obj.id))
+
+    await _gather(trashOne(obj) for obj in gmailObjects)
+
+
+async def getAttachmentData(gmailMessage, filename, duplicateIndex=0):
+    """The async version of the ``GmailMessage.getAttachmentData()`` method. Returns a bytes object of the contents of
+    the attachment named ``filename`` in ``gmailMessage``."""
+    await fetchFullMessages(gmailMessage)
+    attachmentInfo = gmailMessage._attachmentsInfo[gmailMessage._findAttachment(filename, duplicateIndex)]
+    attachmentData = await _getAttachmentBase64Data(gmailMessage, attachmentInfo)
+    return await _runInThread(_decodeBase64Data, attachmentData)
+
+
+async def downloadAttachment(gmailMessage, filename, downloadFolder=".", duplicateIndex=0):
+    """The async version of the ``GmailMessage.downloadAttachment()`` method. Downloads the attachment named
+    ``filename`` in ``gmailMessage`` to the folder ``downloadFolder``."""
+    await fetchFullMessages(gmailMessage)
+    attachmentInfo = gmailMessage._attachmentsInfo[gmailMessage._findAttachment(filename, duplicateIndex)]
+    _makeDownloadFolder(downloadFolder)
+    attachmentData = await _getAttachmentBase64Data(gmailMessage, attachmentInfo)
+    await _runInThread(_saveBase64Data, attachmentData, os.path.join(downloadFolder, filename))
+
+
+async def downloadAllAttachments(gmailMessage, downloadFolder=".", overwrite=True):
+    """The async version of the ``GmailMessage.downloadAllAttachments()`` method. Downloads all of the attachments in
+    ``gmailMessage`` to the folder ``downloadFolder`` at the same time, and returns a list of their filenames."""
+    await fetchFullMessages(gmailMessage)
+    attachmentFilenames = list(gmailMessage.attachments)
+    if not overwrite and len(attachmentFilenames) != len(set(attachmentFilenames)):
+        raise EZGmailException(
+            "There are duplicate filenames in this message's attachments. Pass overwrite=True to "
+            "downloadAllAttachments() to download them anyway."
+        )
+    _makeDownloadFolder(downloadFolder)
+
+    async def downloadOne(attachmentInfo):
+        attachmentData = await _getAttachmentBase64Data(gmailMessage, attachmentInfo)
+        await _runInThread(_saveBase64Data, attachmentData, os.path.join(downloadFolder, attachmentInfo["filename"]))
+
+    # Like downloadAllAttachments(), only download the last of the attachments that share a filename.
+    lastIndexOfFilename = {info["filename"]: i for i, info in enumerate(gmailMessage._attachmentsInfo)}
+    await _gather(downloadOne(gmailMessage._attachmentsInfo[i]) for i in sorted(lastIndexOfFilename.values()))
+    return attachmentFilenames
+
+
+async def _getAttachmentBase64Data(gmailMessage, attachmentInfo):
+    """Returns the base64 string of the attachment described by ``attachmentInfo`` in ``gmailMessage``."""
+    response = await _execute(
+        ezgmail._getResource("attachments").get(id=attachmentInfo["id"], messageId=gmailMessage.id, userId="me")
+    )
+    return response["data"]
+
+
+def _makeDownloadFolder(downloadFolder):
+    """Makes sure ``downloadFolder`` exists and isn't a file."""
+    if not os.path.exists(downloadFolder):
+        os.makedirs(downloadFolder)
+    elif os.path.isfile(downloadFolder):
+        raise EZGmailException("%s is a file, not a folder" % downloadFolder)
+
+
+def _decodeBase64Data(data):
+    """Returns the bytes of the URL-safe base64 string ``data``. This is called in a separate thread."""
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _saveBase64Data(data, filename):
+    """Writes the decoded bytes of the URL-safe base64 string ``data`` to the file ``filename``. This is called in a
+    separate thread."""
+    with open(filename, "wb") as fo:
+        ezgmail._writeBase64Data(data, fo)
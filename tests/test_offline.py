@@ -0,0 +1,1007 @@
+"""Tests for EZGmail's internal helpers that don't need a Gmail account or network access. (The tests in
+test_ezgmail.py need a real test account; see the README.) Run them with ``pytest tests/test_offline.py``."""
+
+import asyncio
+import base64
+import email
+import inspect
+import io
+import json
+import os
+import random
+import threading
+import time
+
+os.environ.setdefault("EZGMAIL_LAZY_INIT", "1")  # Don't log in when ezgmail is imported.
+
+import httplib2  # noqa: E402
+import pytest  # noqa: E402
+from googleapiclient.errors import HttpError  # noqa: E402
+from googleapiclient.http import MediaIoBaseUpload  # noqa: E402
+
+import ezgmail  # noqa: E402
+import ezgmail.aio  # noqa: E402
+
+
+def b64(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii")
+
+
+def makeMessageObj(messageId, threadId="t1", subject="Hello", body="Hello world", attachments=(), internalDate=0):
+    """Returns a dictionary like the one users.messages.get() returns for a multipart/mixed message with a text/plain
+    body and an attachment part for each (filename, bytes) tuple in ``attachments``."""
+    parts = [
+        {
+            "partId": "0",
+            "mimeType": "text/plain",
+            "filename": "",
+            "headers": [{"name": "Content-Type", "value": 'text/plain; charset="UTF-8"'}],
+            "body": {"size": len(body), "data": b64(body)},
+        }
+    ]
+    for i, (filename, data) in enumerate(attachments):
+        parts.append(
+            {
+                "partId": str(i + 1),
+                "mimeType": "application/octet-stream",
+                "filename": filename,
+                "headers": [],
+                "body": {"attachmentId": "att-%s-%d" % (messageId, i), "size": len(data)},
+            }
+        )
+    return {
+        "id": messageId,
+        "threadId": threadId,
+        "labelIds": ["INBOX", "UNREAD"],
+        "snippet": body[:100],
+        "historyId": "100",
+        "internalDate": str(internalDate),
+        "payload": {
+            "partId": "",
+            "mimeType": "multipart/mixed",
+            "filename": "",
+            "headers": [
+                {"name": "From", "value": "Alice <alice@example.com>"},
+                {"name": "To", "value": "bob@example.com"},
+                {"name": "Subject", "value": subject},
+                {"name": "Date", "value": "Sun, 1 Jan 2023 00:00:00 -0000"},
+            ],
+            "body": {"size": 0},
+            "parts": parts,
+        },
+    }
+
+
+def test_payloadCache_size(tmp_path):
+    cache = ezgmail._PayloadCache(str(tmp_path / "cache.sqlite"), None)
+    assert cache.size() == 0
+
+    cache.put("message", makeMessageObj("m1"))
+    cache.put("message", makeMessageObj("m2"))
+    sizeOfTwo = cache.size()
+    assert sizeOfTwo > 0
+
+    # Replacing an entry doesn't count it twice:
+    cache.put("message", makeMessageObj("m2", body="A longer body than before"))
+    assert cache.size() > sizeOfTwo
+    cache.put("message", makeMessageObj("m2"))
+    assert cache.size() == sizeOfTwo
+
+    cache.delete("message", "m2")
+    cache.delete("message", "doesNotExist")
+    sizeOfOne = cache.size()
+    assert 0 < sizeOfOne < sizeOfTwo
+    cache.close()
+
+    # The running total is worked out again when the cache is opened:
+    cache = ezgmail._PayloadCache(str(tmp_path / "cache.sqlite"), None)
+    assert cache.size() == sizeOfOne
+    cache.clear()
+    assert cache.size() == 0
+    cache.close()
+
+
+def test_payloadCache_evict(tmp_path):
+    sizingCache = ezgmail._PayloadCache(str(tmp_path / "sizing.sqlite"), None)
+    sizingCache.put("message", makeMessageObj("m0"))
+    oneSize = sizingCache.size()
+    sizingCache.close()
+
+    cache = ezgmail._PayloadCache(str(tmp_path / "cache.sqlite"), oneSize * 3)
+    for i in range(3):
+        cache.put("message", makeMessageObj("m%d" % i))
+    assert cache.size() == oneSize * 3
+    assert cache.get("message", "m0") is not None  # Now m1 is the least recently used.
+
+    cache.put("message", makeMessageObj("m3"))
+    assert cache.size() <= oneSize * 3
+    assert cache.get("message", "m1") is None
+    for messageId in ("m0", "m2", "m3"):
+        assert cache.get("message", messageId)["id"] == messageId
+    cache.close()
+
+
+def test_payloadCache_putMany(tmp_path, monkeypatch):
+    cache = ezgmail._PayloadCache(str(tmp_path / "cache.sqlite"), None)
+    monkeypatch.setattr(ezgmail, "_CACHE", cache)
+    messageObjs = [makeMessageObj("m1"), makeMessageObj("m2")]
+    ezgmail._cacheThreadObj({"id": "t1", "historyId": "100", "snippet": "Hello", "messages": messageObjs})
+    threadObj = ezgmail._getCachedThreadObj("t1", "100")
+    assert [messageObj["id"] for messageObj in threadObj["messages"]] == ["m1", "m2"]
+    assert cache.get("thread", "t1", historyId="101") is None  # A different historyId means it's stale.
+    cache.close()
+
+
+def historyChange(messageId, labelIds=None):
+    change = {"message": {"id": messageId, "threadId": "t1"}}
+    if labelIds is not None:
+        change["labelIds"] = labelIds
+    return change
+
+
+def test_addHistoryRecord():
+    messagesAdded, messagesDeleted, labelsAdded, labelsRemoved = {}, {}, {}, {}
+
+    def addHistoryRecord(**historyRecord):
+        ezgmail._addHistoryRecord(messagesAdded, messagesDeleted, labelsAdded, labelsRemoved, historyRecord)
+
+    addHistoryRecord(messagesAdded=[historyChange("m1"), historyChange("m2"), historyChange("m3")])
+    addHistoryRecord(messagesAdded=[historyChange("m2")])  # Duplicates are ignored.
+    assert list(messagesAdded) == ["m1", "m2", "m3"]
+
+    # Label changes that undo each other cancel out:
+    addHistoryRecord(labelsRemoved=[historyChange("m1", ["UNREAD", "INBOX"])])
+    addHistoryRecord(labelsAdded=[historyChange("m1", ["UNREAD"])])
+    assert labelsAdded == {}
+    assert list(labelsRemoved["m1"]) == ["INBOX"]
+    addHistoryRecord(labelsAdded=[historyChange("m1", ["INBOX"]), historyChange("m3", ["STARRED", "STARRED"])])
+    assert labelsRemoved == {}
+    assert list(labelsAdded["m3"]) == ["STARRED"]
+
+    # Deleting a message drops its other changes, and later label changes to it are ignored:
+    addHistoryRecord(messagesDeleted=[historyChange("m3"), historyChange("m4")])
+    addHistoryRecord(labelsAdded=[historyChange("m4", ["TRASH"])])
+    assert list(messagesAdded) == ["m1", "m2"]
+    assert list(messagesDeleted) == ["m3", "m4"]
+    assert labelsAdded == {}
+
+
+@pytest.fixture
+def searchCache(tmp_path, monkeypatch):
+    """A cache with two cached threads, for the searchLocal() tests."""
+    cache = ezgmail._PayloadCache(str(tmp_path / "cache.sqlite"), None)
+    if not cache.hasIndex:
+        cache.close()
+        pytest.skip("this Python's SQLite doesn't have FTS5")
+    monkeypatch.setattr(ezgmail, "_CACHE", cache)
+
+    oneDay = 24 * 60 * 60 * 1000
+    januaryFirst = 1672531200000 + oneDay // 2  # Noon UTC on 2023/01/01, so it's January 1st in any time zone.
+    meeting = makeMessageObj("m1", "t1", "Meeting notes", "Notes from the budget meeting", internalDate=januaryFirst)
+    reply = makeMessageObj("m2", "t1", "Re: Meeting notes", "Thanks for the notes", internalDate=januaryFirst + oneDay)
+    reply["labelIds"] = ["INBOX"]
+    invoice = makeMessageObj(
+        "m3", "t2", "Invoice", "Please see the attached invoice", [("invoice.pdf", b"%PDF")], januaryFirst + 2 * oneDay
+    )
+    ezgmail._cacheThreadObj({"id": "t1", "historyId": "100", "snippet": "", "messages": [meeting, reply]})
+    cache.put("message", invoice)  # Only the message is cached, not its thread.
+    yield cache
+    cache.close()
+
+
+def test_searchIndex(searchCache):
+    def searchIds(query):
+        return ezgmail._searchIndex(query, None, byThread=False)
+
+    assert searchIds("notes") == ["m2", "m1"]  # Most recent first.
+    assert searchIds("budget") == ["m1"]
+    assert searchIds('"budget meeting"') == ["m1"]
+    assert searchIds("subject:invoice") == ["m3"]
+    assert searchIds("from:alice@example.com -notes") == ["m3"]
+    assert searchIds("filename:invoice.pdf") == ["m3"]
+    assert searchIds("has:attachment") == ["m3"]
+    assert searchIds("is:unread") == ["m3", "m1"]
+    assert searchIds("after:2023/01/02") == ["m3", "m2"]
+    assert searchIds("before:2023/01/02") == ["m1"]
+    assert searchIds("nonexistentword") == []
+    assert ezgmail._searchIndex("notes", None, byThread=True) == ["t1"]
+
+    with pytest.raises(ezgmail.EZGmailException):
+        searchIds("has:drive")
+    with pytest.raises(ezgmail.EZGmailException):
+        searchIds("after:yesterday")
+    with pytest.raises(ezgmail.EZGmailException):
+        searchIds("larger:10M")
+
+
+def test_searchLocal(searchCache):
+    gmailThreads = ezgmail.searchLocal("from:alice")
+    assert [gmailThread.id for gmailThread in gmailThreads] == ["t2", "t1"]
+    assert [gmailMessage.id for gmailMessage in gmailThreads[0].messages] == ["m3"]
+    assert [gmailMessage.id for gmailMessage in gmailThreads[1].messages] == ["m1", "m2"]
+
+    gmailMessages = ezgmail.searchLocalMessages("notes", maxResults=1)
+    assert [gmailMessage.subject for gmailMessage in gmailMessages] == ["Re: Meeting notes"]
+
+
+class FakeResource:
+    """Stands in for the objects returned by ``_getResource()``. Its methods return a dictionary of the method name and
+    keyword arguments instead of an HttpRequest object, and each test's stand-in for ``_execute()`` answers them."""
+
+    def __getattr__(self, methodName):
+        return lambda **kwargs: dict(kwargs, method=methodName)
+
+
+def test_attachmentsOfMetadataOnlyMessage(tmp_path, monkeypatch):
+    attachmentData = bytes(range(256)) * 10
+    fullMessageObj = makeMessageObj("m1", attachments=[("data.bin", attachmentData)])
+    metadataMessageObj = dict(fullMessageObj)
+    metadataMessageObj["payload"] = {
+        "mimeType": "multipart/mixed",
+        "headers": fullMessageObj["payload"]["headers"],
+    }  # This is what a format="metadata" users.messages.get() call returns, like search(prefetch=False) uses.
+
+    requests = []
+
+    def fakeExecute(request):
+        requests.append(request)
+        if "messageId" in request:
+            assert request["id"] == "att-m1-0"
+            return {"size": len(attachmentData), "data": b64(attachmentData)}
+        assert request["id"] == "m1"
+        return fullMessageObj
+
+    monkeypatch.setattr(ezgmail, "_getResource", lambda name: FakeResource())
+    monkeypatch.setattr(ezgmail, "_execute", fakeExecute)
+
+    gmailMessage = ezgmail.GmailMessage(metadataMessageObj, _metadataOnly=True)
+    assert gmailMessage.getAttachmentData("data.bin") == attachmentData
+    assert len(requests) == 2  # One to download the full message, and one for the attachment.
+
+    gmailMessage = ezgmail.GmailMessage(metadataMessageObj, _metadataOnly=True)
+    gmailMessage.downloadAttachment("data.bin", str(tmp_path))
+    with open(str(tmp_path / "data.bin"), "rb") as fo:
+        assert fo.read() == attachmentData
+
+    gmailMessage = ezgmail.GmailMessage(metadataMessageObj, _metadataOnly=True)
+    gmailMessage.saveAttachment("data.bin", str(tmp_path / "saved.bin"))
+    with open(str(tmp_path / "saved.bin"), "rb") as fo:
+        assert fo.read() == attachmentData
+    with pytest.raises(ezgmail.EZGmailException):
+        gmailMessage.saveAttachment("data.bin", str(tmp_path / "saved.bin"), duplicateIndex=1)
+
+
+def test_writeBase64Data():
+    data = bytes(range(256)) * 3 + b"\xff\xfe"  # Not a multiple of 3 bytes, so the base64 string has padding.
+    encoded = base64.urlsafe_b64encode(data).decode("ascii")
+    for chunkSize in (4, 8, 12, 400, 1024 * 1024, None):
+        for base64String in (encoded, encoded.rstrip("=")):  # Gmail sometimes leaves out the padding.
+            fo = io.BytesIO()
+            ezgmail._writeBase64Data(base64String, fo, chunkSize)
+            assert fo.getvalue() == data
+
+    fo = io.BytesIO()
+    ezgmail._writeBase64Data("", fo)
+    assert fo.getvalue() == b""
+    with pytest.raises(ezgmail.EZGmailException):
+        ezgmail._writeBase64Data(encoded, io.BytesIO(), 10)
+
+
+def test_walkPayload():
+    def leaf(partId, mimeType, text, filename=""):
+        if filename:
+            body = {"attachmentId": "att-" + partId, "size": len(text)}  # Attachments are downloaded separately.
+        else:
+            body = {"size": len(text), "data": b64(text)}
+        return {"partId": partId, "mimeType": mimeType, "filename": filename, "body": body}
+
+    payload = {
+        "mimeType": "multipart/mixed",
+        "parts": [
+            {
+                "mimeType": "multipart/related",
+                "parts": [
+                    {
+                        "mimeType": "multipart/alternative",
+                        "parts": [leaf("0.0.0", "text/plain", "Plain body"), leaf("0.0.1", "text/html", "<b>HTML</b>")],
+                    },
+                    leaf("0.1", "image/png", "PNG", "logo.png"),
+                ],
+            },
+            leaf("1", "application/pdf", "PDF", "report.pdf"),
+        ],
+    }
+    leafParts = []
+    ezgmail._walkPayload(payload, leafParts)
+    assert [part["partId"] for part in leafParts] == ["0.0.0", "0.0.1", "0.1", "1"]
+
+    singlePart = leaf("", "text/plain", "Not multipart")
+    leafParts = []
+    ezgmail._walkPayload(singlePart, leafParts)
+    assert leafParts == [singlePart]
+
+    messageObj = makeMessageObj("m1")
+    messageObj["payload"]["parts"] = payload["parts"]
+    gmailMessage = ezgmail.GmailMessage(messageObj)
+    assert gmailMessage.body == "Plain body"
+    assert gmailMessage.htmlBody == "<b>HTML</b>"
+    assert gmailMessage.attachments == ["logo.png", "report.pdf"]
+
+
+def test_deletePermanently(monkeypatch):
+    requests = []
+    monkeypatch.setattr(ezgmail, "SERVICE_GMAIL", object())  # Keeps deletePermanently() from calling init().
+    monkeypatch.setattr(ezgmail, "_getResource", lambda name: FakeResource())
+    monkeypatch.setattr(ezgmail, "_execute", requests.append)
+    gmailMessages = [ezgmail.GmailMessage(makeMessageObj("m%d" % i)) for i in range(3)]
+
+    with pytest.raises(ValueError):
+        ezgmail.deletePermanently(gmailMessages)
+    with pytest.raises(ValueError):
+        ezgmail.deletePermanently(gmailMessages, force="yes")
+    assert requests == []
+
+    assert ezgmail.deletePermanently(iter(gmailMessages), force=True) == []
+    assert requests == [{"method": "batchDelete", "userId": "me", "body": {"ids": ["m0", "m1", "m2"]}}]
+
+
+def test_aioSessionIsClosedWhenTheLoopChanges(monkeypatch):
+    pytest.importorskip("aiohttp")
+    monkeypatch.setattr(ezgmail.aio, "_SESSION", None)
+    monkeypatch.setattr(ezgmail.aio, "_SESSION_LOOP", None)
+
+    async def getSessionTwice():
+        session = await ezgmail.aio._getSession()
+        assert await ezgmail.aio._getSession() is session  # The same loop reuses the same session.
+        return session
+
+    firstSession = asyncio.run(getSessionTwice())
+    secondSession = asyncio.run(getSessionTwice())  # A new asyncio.run() call has a new loop.
+    assert firstSession.closed
+    assert not secondSession.closed
+    asyncio.run(ezgmail.aio.close())
+    assert secondSession.closed
+
+
+def test_aioSend(monkeypatch):
+    pytest.importorskip("aiohttp")
+    sentBodies = []
+    uploadedMessages = []
+
+    async def fakeExecute(request):
+        sentBodies.append(request["body"])
+        return {"id": "sent1"}
+
+    monkeypatch.setattr(ezgmail, "LOGGED_IN", True)
+    monkeypatch.setattr(ezgmail, "EMAIL_ADDRESS", "alice@example.com")
+    monkeypatch.setattr(ezgmail, "_getResource", lambda name: FakeResource())
+    monkeypatch.setattr(ezgmail.aio, "_execute", fakeExecute)
+    monkeypatch.setattr(ezgmail, "_sendMessage", lambda message, *args: uploadedMessages.append(message))
+
+    progress = []
+    asyncio.run(ezgmail.aio.send("bob@example.com", "Hi", "Hello", progressCallback=lambda *args: progress.append(args)))
+    asyncio.run(ezgmail.aio.send("bob@example.com", "Re: Hi", "Hello again", _threadId="t1"))
+    assert [body.get("threadId") for body in sentBodies] == [None, "t1"]
+    assert progress[0][0] == progress[0][1] == ezgmail._getRawMessageSize(sentBodies[0])
+    assert uploadedMessages == []
+
+    # Messages bigger than RESUMABLE_UPLOAD_SIZE go through ezgmail's resumable upload instead:
+    monkeypatch.setattr(ezgmail, "RESUMABLE_UPLOAD_SIZE", 10)
+    asyncio.run(ezgmail.aio.send("bob@example.com", "Big", "A body that's bigger than ten bytes", _threadId="t2"))
+    assert len(sentBodies) == 2
+    assert len(uploadedMessages) == 1
+    assert uploadedMessages[0]["threadId"] == "t2"
+
+
+def makeHttpError(status, reason=None, retryAfter=None):
+    headers = {"status": str(status)}
+    if retryAfter is not None:
+        headers["retry-after"] = retryAfter
+    content = {"error": {"code": status, "message": "Error"}}
+    if reason is not None:
+        content["error"]["errors"] = [{"reason": reason}]
+    return HttpError(httplib2.Response(headers), json.dumps(content).encode("utf-8"))
+
+
+def test_getRetryDelay(monkeypatch):
+    monkeypatch.setattr(ezgmail, "MAX_RETRIES", 3)
+    monkeypatch.setattr(ezgmail, "RETRY_BASE_DELAY", 1)
+    monkeypatch.setattr(ezgmail, "MAX_RETRY_DELAY", 3)
+
+    for status in (429, 500, 503):
+        for attempt in range(3):
+            assert 0 <= ezgmail._getRetryDelay(makeHttpError(status), attempt) <= min(2**attempt, 3)
+        assert ezgmail._getRetryDelay(makeHttpError(status), 3) is None  # That was the last retry.
+
+    assert ezgmail._getRetryDelay(makeHttpError(429, retryAfter="2"), 0) == 2
+    assert ezgmail._getRetryDelay(makeHttpError(429, retryAfter="120"), 0) == 3  # Capped at MAX_RETRY_DELAY.
+    assert ezgmail._getRetryDelay(makeHttpError(403, "userRateLimitExceeded"), 0) is not None
+    assert ezgmail._getRetryDelay(makeHttpError(403, "insufficientPermissions"), 0) is None
+    assert ezgmail._getRetryDelay(makeHttpError(403), 0) is None
+    assert ezgmail._getRetryDelay(makeHttpError(400), 0) is None
+    assert ezgmail._getRetryDelay(makeHttpError(404), 0) is None
+
+    # Non-idempotent calls are retried after rate limit errors, but not server errors:
+    assert ezgmail._getRetryDelay(makeHttpError(429), 0, retryServerErrors=False) is not None
+    assert ezgmail._getRetryDelay(makeHttpError(403, "rateLimitExceeded"), 0, retryServerErrors=False) is not None
+    assert ezgmail._getRetryDelay(makeHttpError(500), 0, retryServerErrors=False) is None
+    assert ezgmail._getRetryDelay(makeHttpError(503), 0, retryServerErrors=False) is None
+
+
+class FakeRequest:
+    """Stands in for an HttpRequest whose ``execute()`` raises each of the HttpErrors in ``errors`` in turn, and then
+    returns ``response``."""
+
+    def __init__(self, methodId, errors, response):
+        self.methodId = methodId
+        self.errors = list(errors)
+        self.response = response
+        self.calls = 0
+
+    def execute(self, http=None):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.response
+
+
+def test_executeDoesNotResendAfterServerErrors(monkeypatch):
+    monkeypatch.setattr(ezgmail, "_CREDENTIALS", None)
+    monkeypatch.setattr(ezgmail, "_getThreadHttp", lambda: None)
+    monkeypatch.setattr(ezgmail, "RETRY_BASE_DELAY", 0)
+
+    request = FakeRequest("gmail.users.messages.get", [makeHttpError(500), makeHttpError(429)], {"id": "m1"})
+    assert ezgmail._execute(request) == {"id": "m1"}
+    assert request.calls == 3
+
+    request = FakeRequest("gmail.users.messages.send", [makeHttpError(429)], {"id": "sent1"})
+    assert ezgmail._execute(request) == {"id": "sent1"}
+    assert request.calls == 2
+
+    request = FakeRequest("gmail.users.messages.send", [makeHttpError(503)], {"id": "sent1"})
+    with pytest.raises(HttpError):
+        ezgmail._execute(request)
+    assert request.calls == 1
+
+
+class FakeUploadRequest:
+    """A fake HttpRequest with a resumable upload. Each call to ``next_chunk()`` raises the next exception in
+    ``chunks``, or returns the ``(status, response)`` tuple for the number of bytes uploaded (or ``None`` when the
+    upload is done)."""
+
+    class Status:
+        def __init__(self, resumable_progress):
+            self.resumable_progress = resumable_progress
+
+    class Media:
+        def size(self):
+            return 100
+
+    methodId = "gmail.users.messages.send"
+    resumable = Media()
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.https = []
+
+    def next_chunk(self, http=None):
+        self.https.append(http)
+        chunk = self.chunks.pop(0)
+        if isinstance(chunk, Exception):
+            raise chunk
+        if chunk is None:
+            return None, {"id": "sent1"}
+        return self.Status(chunk), None
+
+
+def test_executeUploadResumesAfterErrors(monkeypatch):
+    threadHttp = object()
+    monkeypatch.setattr(ezgmail, "_CREDENTIALS", None)
+    monkeypatch.setattr(ezgmail, "_getThreadHttp", lambda: threadHttp)
+    monkeypatch.setattr(ezgmail, "QUOTA_UNITS_PER_SECOND", None)
+    monkeypatch.setattr(ezgmail, "RETRY_BASE_DELAY", 0)
+    monkeypatch.setattr(ezgmail, "MAX_RETRIES", 2)
+
+    # Two failures in a row are retried, and the count starts over after each chunk that gets through.
+    request = FakeUploadRequest(
+        [OSError(), httplib2.HttpLib2Error(), 30, makeHttpError(503), OSError(), 60, makeHttpError(429), 90, None]
+    )
+    progress = []
+    assert ezgmail._executeUpload(request, lambda *args: progress.append(args)) == {"id": "sent1"}
+    assert request.chunks == []
+    assert request.https == [threadHttp] * 9  # Every chunk is sent with this thread's transport.
+    assert progress == [(30, 100), (60, 100), (90, 100), (100, 100)]
+
+    # A third failure in a row raises the exception.
+    request = FakeUploadRequest([30, OSError(), makeHttpError(500), httplib2.HttpLib2Error(), None])
+    with pytest.raises(httplib2.HttpLib2Error):
+        ezgmail._executeUpload(request)
+    assert request.chunks == [None]
+
+    # Errors that aren't temporary aren't retried.
+    request = FakeUploadRequest([makeHttpError(400), None])
+    with pytest.raises(HttpError):
+        ezgmail._executeUpload(request)
+    assert request.chunks == [None]
+
+
+def test_getSendArgs():
+    sendParameters = list(inspect.signature(ezgmail.send).parameters)
+    assert list(ezgmail._SEND_PARAMETERS) == sendParameters
+
+    def callback(bytesSent, totalBytes):
+        pass
+
+    message = ("bob@example.com", "Hi", "Hello", ["a.txt"], None, "cc@example.com", None, "html", callback, "t1")
+    assert ezgmail._getSendArgs(message) == dict(zip(sendParameters, message))
+    assert ezgmail._getSendArgs(["bob@example.com", "Hi", "Hello"]) == {
+        "recipient": "bob@example.com",
+        "subject": "Hi",
+        "body": "Hello",
+    }
+    assert ezgmail._getSendArgs({"recipient": "bob@example.com", "cc": "cc@example.com"}) == {
+        "recipient": "bob@example.com",
+        "cc": "cc@example.com",
+    }
+    with pytest.raises(ezgmail.EZGmailException):
+        ezgmail._getSendArgs(message + ("extra",))
+    with pytest.raises(ezgmail.EZGmailException):
+        ezgmail._getSendArgs({"recipient": "bob@example.com", "to": "bob@example.com"})
+
+
+def test_sendManyMatchesSendParameters(monkeypatch):
+    createdMessages = []
+    sentMessages = []
+
+    def fakeCreateSendMessage(**kwargs):
+        createdMessages.append(kwargs)
+        return {"raw": ""}
+
+    def fakeSendMessage(message, userId="me", progressCallback=None):
+        sentMessages.append(progressCallback)
+        return {"id": "sent%d" % len(sentMessages), "threadId": "t1"}
+
+    monkeypatch.setattr(ezgmail, "SERVICE_GMAIL", object())
+    monkeypatch.setattr(ezgmail, "_createSendMessage", fakeCreateSendMessage)
+    monkeypatch.setattr(ezgmail, "_sendMessage", fakeSendMessage)
+
+    def callback(bytesSent, totalBytes):
+        pass
+
+    results = ezgmail.sendMany(
+        [
+            ("bob@example.com", "Hi", "Hello", None, None, None, None, "plain", callback, "t1"),
+            {"recipient": "carol@example.com", "subject": "Hi", "body": "Hello", "progressCallback": callback},
+            ("dave@example.com", "Hi", "Hello", None, None, None, None, "plain", None, "t2", "extra"),
+        ],
+        workers=1,
+    )
+    assert [result.id for result in results] == ["sent1", "sent2", None]
+    assert isinstance(results[2].exception, ezgmail.EZGmailException)
+    assert createdMessages[0]["_threadId"] == "t1"  # Not passed as the progressCallback.
+    assert createdMessages[1] == {"recipient": "carol@example.com", "subject": "Hi", "body": "Hello"}
+    assert sentMessages == [callback, callback]
+
+
+def test_sendManyCheckpointsEachMessageWhenSent(tmp_path, monkeypatch):
+    checkpointFile = str(tmp_path / "checkpoint.jsonl")
+    firstMessageCanFinish = threading.Event()
+
+    def fakeSendMessage(message, userId="me", progressCallback=None):
+        if message["raw"] == "bob@example.com":
+            assert firstMessageCanFinish.wait(5)
+        return {"id": "sent-" + message["raw"], "threadId": "t1"}
+
+    monkeypatch.setattr(ezgmail, "SERVICE_GMAIL", object())
+    monkeypatch.setattr(ezgmail, "_createSendMessage", lambda **kwargs: {"raw": kwargs["recipient"]})
+    monkeypatch.setattr(ezgmail, "_sendMessage", fakeSendMessage)
+
+    def getMessages():
+        # Each run passes a different progressCallback function, which shouldn't keep the messages from resuming.
+        def callback(bytesSent, totalBytes):
+            pass
+
+        return [
+            {"recipient": "bob@example.com", "subject": "Hi", "body": "Hello", "progressCallback": callback},
+            ("carol@example.com", "Hi", "Hello", None, None, None, None, "plain", callback),
+        ]
+
+    results = []
+    thread = threading.Thread(target=lambda: results.extend(ezgmail.sendMany(getMessages(), 2, checkpointFile)))
+    thread.start()
+    # Carol's message is recorded as soon as it's sent, even though Bob's result hasn't been yielded yet.
+    for i in range(500):
+        if os.path.exists(checkpointFile) and os.path.getsize(checkpointFile):
+            break
+        time.sleep(0.01)
+    with open(checkpointFile, encoding="utf-8") as fo:
+        assert [json.loads(line)["id"] for line in fo] == ["sent-carol@example.com"]
+    firstMessageCanFinish.set()
+    thread.join()
+    assert [result.id for result in results] == ["sent-bob@example.com", "sent-carol@example.com"]
+
+    monkeypatch.setattr(ezgmail, "_sendMessage", None)  # Nothing should be sent again.
+    results = ezgmail.sendMany(getMessages(), 2, checkpointFile)
+    assert [(result.id, result.resumed) for result in results] == [
+        ("sent-bob@example.com", True), ("sent-carol@example.com", True)
+    ]
+
+    with pytest.raises(ezgmail.EZGmailException):
+        ezgmail.sendMany([{"recipient": "dave@example.com", "body": object()}], 2, checkpointFile)
+
+
+def parseRawMessage(message):
+    """Returns an email.message.Message object for the ``{'raw': ...}`` dictionary ``message``."""
+    return email.message_from_bytes(base64.urlsafe_b64decode(message["raw"]))
+
+
+def test_messageTemplateRender(tmp_path, monkeypatch):
+    monkeypatch.setattr(ezgmail, "EMAIL_ADDRESS", "alice@example.com")
+    textFilename = str(tmp_path / "notes.txt")
+    with open(textFilename, "w") as fo:
+        fo.write("Some notes.\n")
+    binaryFilename = str(tmp_path / "data.bin")
+    binaryData = bytes(range(256)) * 100
+    with open(binaryFilename, "wb") as fo:
+        fo.write(binaryData)
+
+    template = ezgmail.MessageTemplate("News for $month", "Hello $name.", [textFilename, binaryFilename], cc="cc@x.com")
+    for name in ("Bob", "Carol Jones", "Dave"):  # Different lengths, so the base64 padding trick is used each way.
+        parsedMessage = parseRawMessage(template.render("%s@example.com" % name[0], name=name, month="May"))
+        assert parsedMessage["subject"] == "News for May"
+        assert parsedMessage["to"] == "%s@example.com" % name[0]
+        assert parsedMessage["from"] == "alice@example.com"
+        assert parsedMessage["cc"] == "cc@x.com"
+        parts = parsedMessage.get_payload()
+        assert parts[0].get_payload(decode=True).decode("utf-8") == "Hello %s." % name
+        assert [part.get_filename() for part in parts[1:]] == ["notes.txt", "data.bin"]
+        assert parts[1].get_payload(decode=True) == b"Some notes.\n"
+        assert parts[2].get_payload(decode=True) == binaryData
+
+    parsedMessage = parseRawMessage(template.render("bob@example.com", cc="other@x.com", name="Bob", month="May"))
+    assert parsedMessage["cc"] == "other@x.com"
+
+    # Without attachments, render() makes the same message as send() would:
+    template = ezgmail.MessageTemplate("Hi $name", "Hello $name.")
+    assert template.render("bob@example.com", name="Bob") == ezgmail._createSendMessage(
+        "bob@example.com", "Hi Bob", "Hello Bob."
+    )
+
+    with pytest.raises(ezgmail.EZGmailException):
+        template.render("bob@example.com")  # There's no value for $name.
+    with pytest.raises(ezgmail.EZGmailException):
+        ezgmail.MessageTemplate("Hi $", "Hello").render("bob@example.com")
+
+
+def test_writeMessageFile(tmp_path, monkeypatch):
+    monkeypatch.setattr(ezgmail, "EMAIL_ADDRESS", "alice@example.com")
+    monkeypatch.setattr(ezgmail, "ATTACHMENT_CACHE_SIZE", 0)
+    textFilename = str(tmp_path / "notes.txt")
+    with open(textFilename, "w") as fo:
+        fo.write("Some notes.\n" * 100)
+    binaryFilename = str(tmp_path / "data.bin")
+    binaryData = bytes(range(256)) * 1001  # Not a multiple of 57 bytes, so the last encoded line is short.
+    with open(binaryFilename, "wb") as fo:
+        fo.write(binaryData)
+    args = ("bob@example.com", "Files", "Here they are.", [textFilename, binaryFilename])
+
+    random.seed(42)  # So that both messages have the same MIME boundary.
+    inMemoryMessage = ezgmail._createSendMessage(*args, _threadId="t1")
+    assert isinstance(inMemoryMessage, dict)
+
+    monkeypatch.setattr(ezgmail, "RESUMABLE_UPLOAD_SIZE", 1000)  # Write the message to a temporary file instead.
+    monkeypatch.setattr(ezgmail, "ENCODE_CHUNK_SIZE", 57 * 10)  # Encode the attachment in several chunks.
+    monkeypatch.setattr(ezgmail, "MESSAGE_SPOOL_SIZE", 10000)  # Move the file from memory to disk partway through.
+    random.seed(42)
+    messageFile = ezgmail._createSendMessage(*args, _threadId="t1")
+    assert isinstance(messageFile, ezgmail._MessageFile)
+    assert messageFile.threadId == "t1"
+    with messageFile.fileObj:
+        messageFile.fileObj.seek(0)
+        messageBytes = messageFile.fileObj.read()
+
+    # The message in the temporary file is the same one email.generator would have made:
+    assert messageBytes == base64.urlsafe_b64decode(inMemoryMessage["raw"])
+    parts = email.message_from_bytes(messageBytes).get_payload()
+    assert [part.get_filename() for part in parts[1:]] == ["notes.txt", "data.bin"]
+    assert parts[2].get_payload(decode=True) == binaryData
+
+
+def test_writeMessageFileUsesAttachmentCache(tmp_path, monkeypatch):
+    monkeypatch.setattr(ezgmail, "EMAIL_ADDRESS", "alice@example.com")
+    monkeypatch.setattr(ezgmail, "_ATTACHMENT_CACHE", ezgmail._AttachmentCache())
+    monkeypatch.setattr(ezgmail, "RESUMABLE_UPLOAD_SIZE", 1000)
+    monkeypatch.setattr(ezgmail, "MESSAGE_SPOOL_SIZE", 10000)
+    binaryFilename = str(tmp_path / "data.bin")
+    with open(binaryFilename, "wb") as fo:
+        fo.write(bytes(range(256)) * 1001)
+    args = ("bob@example.com", "Files", "Here they are.", [binaryFilename])
+
+    def readMessageFile():
+        random.seed(42)
+        messageFile = ezgmail._createSendMessage(*args)
+        assert isinstance(messageFile, ezgmail._MessageFile)
+        with messageFile.fileObj:
+            messageFile.fileObj.seek(0)
+            return messageFile.fileObj.read()
+
+    firstMessage = readMessageFile()
+    cachedPart = ezgmail._ATTACHMENT_CACHE.get(ezgmail._getAttachmentCacheKey(binaryFilename))
+    assert cachedPart == ezgmail._createAttachmentPart(binaryFilename).as_bytes()
+
+    # Sending the attachment again copies it from the cache instead of encoding it again:
+    def failToWriteAttachmentPart(attachment, fileObj):
+        raise AssertionError("The attachment was encoded again.")
+
+    monkeypatch.setattr(ezgmail, "_writeAttachmentPart", failToWriteAttachmentPart)
+    assert readMessageFile() == firstMessage
+
+
+def test_createRawSendMessageStartsAtFilePosition(monkeypatch):
+    monkeypatch.setattr(ezgmail, "RESUMABLE_UPLOAD_SIZE", 1000)
+    skippedBytes = b"This isn't part of the message.\n"
+    messageBytes = b"To: bob@example.com\r\nSubject: Hi\r\n\r\n" + b"Hello.\r\n" * 500
+
+    # Small messages are read from the file's current position:
+    fileObj = io.BytesIO(skippedBytes + messageBytes[:500])
+    fileObj.seek(len(skippedBytes))
+    rawMessage = ezgmail._createRawSendMessage(fileObj, "t1")
+    assert base64.urlsafe_b64decode(rawMessage["raw"]) == messageBytes[:500]
+    assert rawMessage["threadId"] == "t1"
+
+    # ...and so are large messages, which are uploaded straight from the file:
+    fileObj = io.BytesIO(skippedBytes + messageBytes)
+    fileObj.seek(len(skippedBytes))
+    messageFile = ezgmail._createRawSendMessage(fileObj, "t1")
+    assert isinstance(messageFile, ezgmail._MessageFile)
+    media = MediaIoBaseUpload(messageFile.fileObj, mimetype="message/rfc822", chunksize=1024 * 1024, resumable=True)
+    assert media.size() == len(messageBytes)
+    assert media.getbytes(0, len(messageBytes)) == messageBytes
+    assert media.getbytes(len(messageBytes) - 10, 100) == messageBytes[-10:]
+
+    messageFile.fileObj.close()
+    assert not fileObj.closed  # The caller's file object is left open.
+
+
+class FakeCredentials:
+    """Stands in for a google.oauth2.credentials.Credentials object whose access token has expired."""
+
+    def __init__(self):
+        self.valid = False
+        self.token = "expired"
+        self.expiry = None  # This keeps _TokenRefresher's thread from refreshing it in the background.
+        self.refresh_token = "refresh"
+        self.refreshes = 0
+
+    def refresh(self, request):
+        self.refreshes += 1
+        self.token = "token%d" % self.refreshes
+        self.valid = True
+
+    def to_json(self):
+        return json.dumps({"token": self.token, "refresh_token": self.refresh_token})
+
+
+def test_refreshCredentialsSavesToken(tmp_path, monkeypatch):
+    tokenFile = str(tmp_path / "token.json")
+    creds = FakeCredentials()
+    monkeypatch.setattr(ezgmail, "_TOKEN_REFRESHER", ezgmail._TokenRefresher(creds, tokenFile))
+
+    ezgmail._refreshCredentials(creds)
+    with open(tokenFile, encoding="utf-8") as fo:
+        assert json.load(fo)["token"] == "token1"
+
+    ezgmail._refreshCredentials(creds)  # The token is still valid, so this does nothing.
+    assert creds.refreshes == 1
+
+    # Credentials that init() didn't log in with aren't saved to its token file:
+    otherCreds = FakeCredentials()
+    ezgmail._refreshCredentials(otherCreds)
+    assert otherCreds.refreshes == 1
+    with open(tokenFile, encoding="utf-8") as fo:
+        assert json.load(fo)["token"] == "token1"
+    assert os.listdir(str(tmp_path)) == ["token.json"]  # No temporary files are left behind.
+
+
+def test_getThreadHttp(monkeypatch):
+    monkeypatch.setattr(ezgmail, "_CREDENTIALS", None)
+    assert ezgmail._getThreadHttp() is None  # init() hasn't been called, so there are no credentials to use.
+
+    creds = FakeCredentials()
+    monkeypatch.setattr(ezgmail, "_CREDENTIALS", creds)
+    http = ezgmail._getThreadHttp()
+    assert http is not None
+    assert http.credentials is creds
+    assert ezgmail._getThreadHttp() is http  # Each thread keeps its transport.
+    assert ezgmail._parallelMap(lambda i: ezgmail._getThreadHttp(), [1, 2], 2)[0] is not http  # Other threads don't.
+
+    monkeypatch.setattr(ezgmail, "_CREDENTIALS", FakeCredentials())  # Like init() was called again.
+    assert ezgmail._getThreadHttp() is not http
+
+
+def test_parallelMapReusesWorkerThreads():
+    threadIds = set()
+
+    def double(number):
+        threadIds.add(threading.get_ident())
+        time.sleep(0.01)
+        return number * 2
+
+    assert ezgmail._parallelMap(double, range(20), 4) == [number * 2 for number in range(20)]
+    pool = ezgmail._getWorkerPool(4)
+    assert ezgmail._parallelMap(double, range(20), 4) == [number * 2 for number in range(20)]
+    assert ezgmail._getWorkerPool(2) is pool  # The same pool (and its threads) is used for later calls.
+    assert len(threadIds) <= ezgmail._WORKER_POOL_SIZE
+    assert threading.get_ident() not in threadIds
+
+    # Calls made from the pool's own threads run in that thread:
+    nestedThreadIds = ezgmail._parallelMap(
+        lambda i: {threading.get_ident()} | set(ezgmail._parallelMap(lambda j: threading.get_ident(), range(3), 3)),
+        range(2),
+        2,
+    )
+    assert all(len(threadIdsOfCall) == 1 for threadIdsOfCall in nestedThreadIds)
+
+    def failOnThree(number):
+        if number == 3:
+            raise ValueError("three")
+        return number
+
+    with pytest.raises(ValueError):
+        ezgmail._parallelMap(failOnThree, range(10), 3)
+
+
+def test_metadataOnlyMessageHeadersAfterDownload(monkeypatch):
+    fullMessageObj = makeMessageObj("m1")
+    fullMessageObj["payload"]["headers"] += [
+        {"name": "Content-Type", "value": 'text/plain; charset="iso-8859-1"'},
+        {"name": "Message-ID", "value": "<1234@example.com>"},
+    ]
+    fullMessageObj["payload"]["mimeType"] = "text/plain"
+    del fullMessageObj["payload"]["parts"]
+    fullMessageObj["payload"]["body"] = {"size": 5, "data": b64("Caf\xe9!".encode("iso-8859-1"))}
+    metadataMessageObj = dict(fullMessageObj)
+    metadataMessageObj["payload"] = {
+        "mimeType": "text/plain",
+        "headers": [header for header in fullMessageObj["payload"]["headers"] if header["name"] in ("From", "To")],
+    }  # A format="metadata" call only returns the headers that were asked for.
+
+    monkeypatch.setattr(ezgmail, "_getResource", lambda name: FakeResource())
+    monkeypatch.setattr(ezgmail, "_execute", lambda request: fullMessageObj)
+
+    gmailMessage = ezgmail.GmailMessage(metadataMessageObj, _metadataOnly=True)
+    assert gmailMessage.subject is None
+    assert gmailMessage.body == "Caf\xe9!"  # Decoded with the charset from the full message's Content-Type header.
+    assert gmailMessage.subject == "Hello"
+    assert gmailMessage.headers["message-id"] == "<1234@example.com>"
+
+
+class FakeBatch:
+    """Stands in for a BatchHttpRequest. Each test's stand-in for ``_execute()`` answers its requests."""
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request):
+        self.requests.append(request)
+
+
+class FakeService:
+    """Stands in for ``SERVICE_GMAIL``, which is only used directly to make batch requests."""
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(callback)
+
+
+@pytest.fixture
+def fakeMailbox(monkeypatch):
+    """Replaces the Gmail API with threads t0 to t4 (with two messages each) and records the requests made to it.
+    Getting thread t4 fails."""
+    mailbox = {"t%d" % i: ["t%d-m0" % i, "t%d-m1" % i] for i in range(5)}
+    requests = []
+
+    def getThread(request):
+        if request["id"] == "t4":
+            raise makeHttpError(404)
+        return {"id": request["id"], "messages": [{"id": messageId} for messageId in mailbox[request["id"]]]}
+
+    def fakeExecute(request):
+        if isinstance(request, FakeBatch):
+            requests.append({"method": "batch", "requests": [r["id"] for r in request.requests]})
+            for i, batchedRequest in enumerate(request.requests):
+                try:
+                    request.callback(str(i), getThread(batchedRequest), None)
+                except HttpError as exc:
+                    request.callback(str(i), None, exc)
+            return None
+        requests.append(request)
+        if request["method"] == "get":
+            return getThread(request)
+        return {}
+
+    monkeypatch.setattr(ezgmail, "SERVICE_GMAIL", FakeService())
+    monkeypatch.setattr(ezgmail, "_getResource", lambda name: FakeResource())
+    monkeypatch.setattr(ezgmail, "_execute", fakeExecute)
+    return mailbox, requests
+
+
+def makeGmailThread(threadId, messageIds=None):
+    """Returns a GmailThread object for ``threadId``. If ``messageIds`` is given, its messages are already downloaded,
+    like a thread from search()."""
+    gmailThread = ezgmail.GmailThread({"id": threadId, "snippet": "", "historyId": "100"})
+    if messageIds is not None:
+        messageObjs = [makeMessageObj(messageId, threadId) for messageId in messageIds]
+        gmailThread._setExtendedThreadObj({"id": threadId, "historyId": "100", "snippet": "", "messages": messageObjs})
+    return gmailThread
+
+
+def test_modifyLabelsOfOneThread(fakeMailbox):
+    mailbox, requests = fakeMailbox
+    gmailThread = makeGmailThread("t0", ["t0-m0"])  # A reply, t0-m1, arrived after the thread was downloaded.
+    gmailThread.markAsRead()
+    assert requests == [
+        {"method": "modify", "userId": "me", "id": "t0", "body": {"addLabelIds": [], "removeLabelIds": ["UNREAD"]}}
+    ]
+
+
+def test_modifyLabelsInChunks(fakeMailbox, monkeypatch):
+    mailbox, requests = fakeMailbox
+    monkeypatch.setattr(ezgmail, "MAX_BATCH_MODIFY_IDS", 3)
+    monkeypatch.setattr(ezgmail, "MAX_BATCH_REQUESTS", 2)
+    gmailObjects = [
+        makeGmailThread("t0"),
+        makeGmailThread("t1", ["t1-m0", "t1-m1"]),  # Already downloaded, so its message ids aren't looked up.
+        makeGmailThread("t2"),
+        makeGmailThread("t3"),
+        ezgmail.GmailMessage(makeMessageObj("m9")),
+        ezgmail.GmailMessage(makeMessageObj("t0-m1")),  # Also in thread t0, so it's only changed once.
+    ]
+    ezgmail.modifyLabels(iter(gmailObjects), addLabels="STARRED", removeLabels=["UNREAD", "INBOX"])
+
+    assert requests[:2] == [{"method": "batch", "requests": ["t0", "t2"]}, {"method": "batch", "requests": ["t3"]}]
+    batchModifyRequests = requests[2:]
+    assert [request["method"] for request in batchModifyRequests] == ["batchModify"] * 3
+    assert [request["body"]["ids"] for request in batchModifyRequests] == [
+        ["m9", "t0-m1", "t0-m0"],
+        ["t1-m0", "t1-m1", "t2-m0"],
+        ["t2-m1", "t3-m0", "t3-m1"],
+    ]
+    for request in batchModifyRequests:
+        assert request["body"]["addLabelIds"] == ["STARRED"]
+        assert request["body"]["removeLabelIds"] == ["UNREAD", "INBOX"]
+
+    # A thread that can't be found raises the usual HttpError:
+    with pytest.raises(HttpError):
+        ezgmail.modifyLabels([makeGmailThread("t0"), makeGmailThread("t4")], addLabels="STARRED")
+
+
+def test_deletePermanentlyReportsThreadsThatCantBeFound(fakeMailbox):
+    mailbox, requests = fakeMailbox
+    gmailThreads = [makeGmailThread("t0"), makeGmailThread("t4"), makeGmailThread("t1")]
+    failures = ezgmail.deletePermanently(gmailThreads, force=True)
+
+    assert len(failures) == 1
+    assert failures[0][0] is gmailThreads[1]
+    assert isinstance(failures[0][1], HttpError)
+    assert requests[-1] == {
+        "method": "batchDelete", "userId": "me", "body": {"ids": ["t0-m0", "t0-m1", "t1-m0", "t1-m1"]}
+    }
+
+
+def test_quotaBudgetAllowsBursts(monkeypatch):
+    monkeypatch.setattr(ezgmail, "QUOTA_UNITS_PER_SECOND", 250)
+    monkeypatch.setattr(ezgmail, "QUOTA_BURST_SECONDS", 5)
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    budget = ezgmail._QuotaBudget()
+
+    assert budget.reserve(1000) == 0  # A batch request for 100 threads doesn't have to wait.
+    assert budget.reserve(500) == pytest.approx(1)  # But the next call waits for the bucket to refill.
+    now[0] += 60
+    assert budget.usage()["availableUnits"] == 1250  # The bucket doesn't fill past QUOTA_BURST_SECONDS seconds.
+
+    monkeypatch.setattr(ezgmail, "QUOTA_BURST_SECONDS", 1)
+    assert budget.reserve(500) == pytest.approx(1)